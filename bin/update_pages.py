@@ -11,8 +11,8 @@ Este scripts es usado para actualizar el hub de relatos de la fundacionscp y var
 # Módulos Importados
 ###############################################################################
 
-import arrow
 import collections
+import datetime
 import logging
 import pyscp
 import re
@@ -22,6 +22,20 @@ import string
 
 log = logging.getLogger('pyscp')
 
+_TITLE_KEYS = tuple(string.ascii_uppercase) + ('misc',)
+_AUTHOR_KEYS = (
+	'A', 'B', 'C', 'D', 'Dr', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M',
+	'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U', 'V', 'W', 'X', 'Y', 'Z', 'misc')
+
+ROLE_ORDER = {'autor': 0, 'reescritor': 1, 'traductor': 2, 'mantenimiento': 3}
+
+_DR_RE = re.compile(r'Dr[^a-z]|Doctor|Doctora|Doc[^a-z]')
+_SERIES_RE = re.compile(r'[scp]+-[es]+-([0-9]+)$')
+_SORT_RE = re.compile(r'[es]+-([0-9]+)')
+_MISC_TAGS = ('explicado', 'humorístico', 'archivado')
+_BRACKETS_TABLE = str.maketrans('', '', '[]')
+_SPACE_TABLE = str.maketrans(' ', '-')
+
 ###############################################################################
 
 TEMPLATE = """
@@ -44,6 +58,9 @@ class Updater:
 		self.wiki = wiki
 		self.pages = pages
 
+	def keys(self):
+		return self._KEYS
+
 	def disp(self):
 		return self.keys()
 
@@ -51,33 +68,44 @@ class Updater:
 		return page.build_attribution_string(
 			user_formatter='[[user {}]]', separator=' _\n')
 
-	def get_section(self, idx):
-		name = self.keys()[idx]
-		disp = self.disp()[idx]
-		pages = [p for p in self.pages if self.keyfunc(p) == name]
+	def get_buckets(self):
+		buckets = collections.defaultdict(list)
+		for page in self.pages:
+			buckets[self.keyfunc(page)].append(page)
+		return buckets
+
+	def get_section(self, name, disp, pages):
 		if pages:
 			body = '\n'.join(map(self.format_page, sorted(pages, key=self.sortfunc)))
 		else:
 			body = self.NODATA
 		return TEMPLATE.format(
-			name=name.replace(' ', '-'), 
+			name=name.translate(_SPACE_TABLE),
 			disp=disp, 
 			header=self.HEADER, 
 			body=body)
 
 	def update(self, *targets):
-		output = ['']
-		for idx in range(len(self.keys())):
-			section = self.get_section(idx)
-			if len(output[-1]) + len(section) < 180000:
-				output[-1] += section
+		buckets = self.get_buckets()
+		chunks, sizes = [[]], [0]
+		for name, disp in zip(self.keys(), self.disp()):
+			section = self.get_section(name, disp, buckets.get(name))
+			if sizes[-1] + len(section) < 180000:
+				chunks[-1].append(section)
+				sizes[-1] += len(section)
 			else:
-				output.append(section)
+				chunks.append([section])
+				sizes.append(len(section))
+		output = [''.join(c) for c in chunks]
 		for idx, target in enumerate(targets):
 			source = output[idx] if idx < len(output) else ''
-			self.wiki(target).revert(0)
-			self.wiki(target).edit(source, comment='Actualización automática')
-			log.info('{} {}'.format(target, len(source)))
+			page = self.wiki(target)
+			if page.source == source.strip():
+				log.info('%s sin cambios', target)
+				continue
+			page.revert(0)
+			page.edit(source, comment='Actualización automática')
+			log.info('%s %d', target, len(source))
 
 ###############################################################################
 
@@ -102,9 +130,7 @@ class TaleUpdater(Updater):
 
 class TalesByTitle(TaleUpdater):
 
-	def keys(self):
-		enie = list(string.ascii_uppercase)
-		return enie  + ['misc']
+	_KEYS = _TITLE_KEYS
 
 	def keyfunc(self, page):
 		l = page._body['title'][0]
@@ -115,15 +141,17 @@ class TalesByTitle(TaleUpdater):
 
 class TalesByAuthor(TaleUpdater):
 
-	def keys(self):
-		enie = sorted(list(string.ascii_uppercase) + ['Dr', 'misc'])
-		return enie
+	_KEYS = _AUTHOR_KEYS
+
+	def get_first_author(self, page):
+		meta = min(
+			page.metadata.values(),
+			key=lambda x: (ROLE_ORDER[x.role], x.date))
+		return meta.user
 
 	def keyfunc(self, page):
-		templates = collections.defaultdict(lambda: '{user}')
-		authors = page.build_attribution_string(templates).split(', ')
-		author = authors[0]
-		if re.match(r'Dr[^a-z]|Doctor|Doctora|Doc[^a-z]', author):
+		author = self.get_first_author(page)
+		if _DR_RE.match(author):
 			return 'Dr'
 		elif author[0].isalpha():
 			return author[0].upper()
@@ -131,19 +159,20 @@ class TalesByAuthor(TaleUpdater):
 			return 'misc'
 	
 	def sortfunc(self, page):
-		author = sorted(page.metadata.keys())[0]
-		return author.lower()
+		return self.get_first_author(page).lower()
 
 class TalesByDate(TaleUpdater):
 
 	def disp(self):
 		return [
-		arrow.get(i, 'YYYY-MM').format('MMMM YYYY') for i in self.keys()]
+			datetime.date(int(i[:4]), int(i[5:]), 1).strftime('%B %Y')
+			for i in self.keys()]
 
 	def keys(self):
-		return [i.format('YYYY-MM') for i in 
-				arrow.Arrow.range('month', arrow.get('2013-11'), arrow.now
-				())]
+		# meses desde noviembre del 2013 hasta el actual, contados desde el año 0
+		today = datetime.date.today()
+		months = range(2013 * 12 + 10, today.year * 12 + today.month)
+		return ['{}-{:02}'.format(i // 12, i % 12 + 1) for i in months]
 
 	def keyfunc(self, page=None):
 		return page.created[:7]
@@ -153,8 +182,7 @@ class TalesByDate(TaleUpdater):
 
 class TranslateTales(TaleUpdater):
 
-	def keys(self):
-		return list(string.ascii_uppercase) + ['misc']
+	_KEYS = _TITLE_KEYS
 
 	def keyfunc(self, page):
 		l = page._body['title'][0]
@@ -191,12 +219,12 @@ class CreditUpdater(Updater):
 	def format_page(self, page):
 		return '||[[[{}|{}]]]||{}||'.format(
 			page._body['fullname'],
-			page.title.replace('[', '').replace(']', ''),
+			page.title.translate(_BRACKETS_TABLE),
 			self.get_author(page))
 
 	def sortfunc(self, page):
 		title = []
-		for word in re.split('[es]+-([0-9]+)', page._body['title']):
+		for word in _SORT_RE.split(page._body['title']):
 			if word.isdigit():
 				title.append(int(word))
 			else:
@@ -212,12 +240,12 @@ class SeriesCredits(CreditUpdater):
 	def __init__(self, wiki, pages, series):
 		super().__init__(wiki, pages)
 		self.series = (series - 1) * 1000
-
-	def keys(self):
-		return ['{:03}-{:03}'.format(i or 2, i + 99)for i in range(self.series, self.series + 999, 100)]
+		self._KEYS = tuple(
+			'{:03}-{:03}'.format(i or 2, i + 99)
+			for i in range(self.series, self.series + 999, 100))
 
 	def keyfunc(self, page):
-		num = re.search('[scp]+-[es]+-([0-9]+)$', page._body['fullname'])
+		num = _SERIES_RE.search(page._body['fullname'])
 		if not num:
 			return
 		num = (int(num.group(1)) // 100) * 100
@@ -225,12 +253,11 @@ class SeriesCredits(CreditUpdater):
 
 class MiscCredits(CreditUpdater):
 
-	def __init__(self, wiki, pages):
-		self.proposals = pyscp.wikidot.Wiki('lafundacionscp')('scp-es-001').links
-		super().__init__(wiki, pages)
+	_KEYS = ('propuesta',) + _MISC_TAGS
 
-	def keys(self):
-		return 'propuesta explicado humorístico archivado'.split()
+	def __init__(self, wiki, pages, source):
+		self.proposals = frozenset(source('scp-es-001').links)
+		super().__init__(wiki, pages)
 
 	def disp(self):
 		return ['Propuestas 001-ES', 
@@ -241,19 +268,19 @@ class MiscCredits(CreditUpdater):
 	def keyfunc(self, page):
 		if page.url in self.proposals:
 			return 'propuesta'
-		for tag in ('explicado', 'humorístico', 'archivado'):
+		for tag in _MISC_TAGS:
 			if tag in page.tags:
 				return tag
 
 
 def update_credit_hubs(wiki):
-	    pages = list(wiki.list_pages(
-		tags='scp +es', body='title created_by tags'))
-	    wiki = pyscp.wikidot.Wiki('borradores-scp-es')
-	    wiki.auth('andres2055', 'morrocoy')
+	pages = list(wiki.list_pages(
+		tags='scp +es', body='title created_by created_at tags'))
+	target = pyscp.wikidot.Wiki('borradores-scp-es')
+	target.auth('andres2055', 'morrocoy')
 
-	    SeriesCredits(wiki, pages, 1).update('serie-ES')
-	    MiscCredits(wiki, pages).update('misc')
+	SeriesCredits(target, pages, 1).update('serie-ES')
+	MiscCredits(target, pages, wiki).update('misc')
 
 ###############################################################################
 
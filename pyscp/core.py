@@ -26,9 +26,11 @@ import abc
 import arrow
 import bs4
 import collections
+import concurrent.futures
 import functools
 import itertools
 import logbook
+import lxml.html
 import re
 import urllib.parse
 
@@ -41,6 +43,10 @@ import pyscp.utils
 logbook.FileHandler('pyscp.log').push_application()
 log = logbook.Logger(__name__)
 
+_WORD_RE = re.compile(r"[\w'█_-]+")
+_MAINLIST_RE = re.compile(r'/scp-[0-9]{3,4}$')
+_URL_TABLE = str.maketrans({' ': '-', '_': '-'})
+
 ###############################################################################
 # Clases Base de Abstracción
 ###############################################################################
@@ -147,8 +153,7 @@ class Page(metaclass=abc.ABCMeta):
     @property
     def _raw_title(self):
         """Título como es mostrado en la página."""
-        title = self._soup.find(id='page-title')
-        return title.text.strip() if title else ''
+        return self._lxml.xpath('string(//*[@id="page-title"])').strip()
 
     @property
     def _raw_author(self):
@@ -159,6 +164,11 @@ class Page(metaclass=abc.ABCMeta):
         """BeautifulSoup del contenido de la página."""
         return bs4.BeautifulSoup(self.html, 'lxml')
 
+    @property
+    def _lxml(self):
+        """Árbol lxml del contenido de la página."""
+        return parse_html(self.html)
+
     ###########################################################################
     # Properties
     ###########################################################################
@@ -181,18 +191,18 @@ class Page(metaclass=abc.ABCMeta):
     @property
     def text(self):
         """Texto llano de la página."""
-        return self._soup.find(id='page-content').text
+        return self._lxml.get_element_by_id('page-content').text_content()
 
-    @property
+    @pyscp.utils.cached_property
     def wordcount(self):
         """Número de palabras encontrados en la página."""
-        return len(re.findall(r"[\w'█_-]+", self.text))
+        return sum(1 for _ in _WORD_RE.finditer(self.text))
 
     @property
     def images(self):
         """Número de imagenes mostradas en la página."""
         # TODO: needs more work.
-        return [i['src'] for i in self._soup('img')]
+        return self._lxml.xpath('//img/@src')
 
     @property
     def name(self):
@@ -216,7 +226,7 @@ class Page(metaclass=abc.ABCMeta):
         """Cuando creas la página."""
         return self.history[0].time
 
-    @property
+    @pyscp.utils.cached_property
     def metadata(self):
         """
         Retorna la página de metadatos
@@ -225,7 +235,7 @@ class Page(metaclass=abc.ABCMeta):
 	a la creación y subsecuente mantenimiento de la página. Los
 	valores en el dict describe a los usuarios relacionados con la página.
         """
-        data = [i for i in self._wiki.metadata() if i.url == self.url]
+        data = self._wiki._metadata_by_url.get(self.url, [])
         data = {i.user: i for i in data}
 
         if 'autor' not in {i.role for i in data.values()}:
@@ -254,8 +264,7 @@ class Page(metaclass=abc.ABCMeta):
 		enlaces a imagenes no son incluidos.
         """
         unique = set()
-        for element in self._soup.select('#page-content a'):
-            href = element.get('href', None)
+        for href in self._lxml.xpath('//*[@id="page-content"]//a/@href'):
             if (not href or href[0] != '/' or  # malo o enlace absoluto
                     href[-4:] in ('.png', '.jpg', '.gif')):
                 continue
@@ -269,9 +278,9 @@ class Page(metaclass=abc.ABCMeta):
         """Padre de la página actual."""
         if not self.html:
             return None
-        breadcrumb = self._soup.select('#breadcrumbs a')
+        breadcrumb = self._lxml.xpath('(//*[@id="breadcrumbs"]//a)[last()]/@href')
         if breadcrumb:
-            return self._wiki.site + breadcrumb[-1]['href']
+            return self._wiki.site + breadcrumb[0]
 
     @property
     def is_mainlist(self):
@@ -284,7 +293,7 @@ class Page(metaclass=abc.ABCMeta):
             return False
         if 'scp' not in self.tags:
             return False
-        return bool(re.search(r'/scp-[0-9]{3,4}$', self.url))
+        return bool(_MAINLIST_RE.search(self.url))
 
     ###########################################################################
     # Metodos
@@ -300,6 +309,29 @@ class Page(metaclass=abc.ABCMeta):
         formatted, human-readable description of who was and is involved with
         the page, and in what role.
         """
+        # solo las plantillas en dict simples pueden usarse como clave del
+        # caché; un defaultdict, por ejemplo, depende de su default_factory
+        if all(i is None or type(i) is dict
+               for i in (templates, group_templates)):
+            key = tuple(
+                None if i is None else tuple(sorted(i.items()))
+                for i in (templates, group_templates))
+            key += (separator, user_formatter)
+            cache = self._attributions
+            if key not in cache:
+                cache[key] = self._build_attribution_string(
+                    templates, group_templates, separator, user_formatter)
+            return cache[key]
+        return self._build_attribution_string(
+            templates, group_templates, separator, user_formatter)
+
+    @pyscp.utils.cached_property
+    def _attributions(self):
+        """Strings de atribución ya construidos, por plantillas usadas."""
+        return {}
+
+    def _build_attribution_string(
+            self, templates, group_templates, separator, user_formatter):
         roles = 'autor reescritor traductor mantenimiento'.split()
 
         if not templates:
@@ -386,7 +418,7 @@ class Wiki(metaclass=abc.ABCMeta):
 
     def __call__(self, name):
         url = name if self.site in name else '{}/{}'.format(self.site, name)
-        url = url.replace(' ', '-').replace('_', '-').lower()
+        url = url.translate(_URL_TABLE).lower()
         return self.Page(self, url)
 
     ###########################################################################
@@ -413,16 +445,26 @@ class Wiki(metaclass=abc.ABCMeta):
             results.append(pyscp.core.Metadata(url, user, type_, date))
         return results
 
+    @pyscp.utils.cached_property
+    def _metadata_by_url(self):
+        """Metadatos de la wiki agrupados por url de página."""
+        index = collections.defaultdict(list)
+        for meta in self.metadata():
+            index[meta.url].append(meta)
+        return index
+
     def _update_titles(self):
-        for name in (
-                'serie-scp-i', 'serie-scp-ii', 'serie-scp-iii', 'serie-scp-iv', 'serie-scp-es'
-                'scps-humoristicos', 'scp-ex', 'scps-archivados'):
-            page = self(name)
+        names = (
+            'serie-scp-i', 'serie-scp-ii', 'serie-scp-iii', 'serie-scp-iv', 'serie-scp-es'
+            'scps-humoristicos', 'scp-ex', 'scps-archivados')
+        pages = [self(name) for name in names]
+        self.prefetch(pages, '_pdata')
+        for name, page in zip(names, pages):
             try:
-                soup = page._soup
+                tree = page._lxml
             except:
                 continue
-            self._title_data[name] = soup
+            self._title_data[name] = tree
 
     @pyscp.utils.ignore(value={})
     @pyscp.utils.log_errors(logger=log.error)
@@ -434,22 +476,27 @@ class Wiki(metaclass=abc.ABCMeta):
 
         self._update_titles()
 
-        elems = [i.select('ul > li') for i in self._title_data.values()]
-        elems = list(itertools.chain(*elems))
+        elems = [
+            li for tree in self._title_data.values()
+            for li in tree.xpath('//ul/li')]
         try:
-            elems += list(self('scp-001')._soup(class_='series')[1]('p'))
+            series = self('scp-001')._lxml.xpath(
+                '//*[contains(concat(" ", @class, " "), " series ")]')
+            elems += series[1].iter('p')
         except:
             pass
 
         titles = {}
         for elem in elems:
 
-            sep = ' - ' if ' - ' in elem.text else ', '
-            try:
-                url1 = self.site + elem.a['href']
-                skip, title = elem.text.split(sep, maxsplit=1)
-            except (ValueError, TypeError):
+            text = elem.text_content()
+            skip, sep, title = text.partition(' - ')
+            if not sep:
+                skip, sep, title = text.partition(', ')
+            href = elem.xpath('string(.//a/@href)')
+            if not sep or not href:
                 continue
+            url1 = self.site + href
 
             if title != '[ACCESO DENEGADO]':
                 url2 = self.site + '/' + skip.lower()
@@ -457,6 +504,31 @@ class Wiki(metaclass=abc.ABCMeta):
 
         return titles
 
+    def prefetch(self, pages, *attrs, max_workers=32):
+        """
+        Precarga en paralelo los atributos dados de cada página.
+
+        Solo tiene efecto con atributos cacheados por la página, como _pdata
+        o history. El primer atributo se carga antes que los demás, ya que
+        suelen depender de él (p. ej. del id que da _pdata); el resto se pide
+        a la vez para cada página. Los errores se ignoran aquí; vuelven a
+        surgir cuando el atributo es accedido normalmente.
+        """
+        def load(page, attr):
+            try:
+                getattr(page, attr)
+            except Exception:
+                return
+            return page
+        if not attrs:
+            return
+        first, *rest = attrs
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+            loaded = pool.map(load, pages, itertools.repeat(first))
+            pages = [p for p in loaded if p is not None]
+            concurrent.futures.wait([
+                pool.submit(load, p, a) for p in pages for a in rest])
+
     def list_pages(self, **kwargs):
         """Retorna páginas relacionadas al criterio especificado."""
         pages = self._list_pages_parsed(**kwargs)
@@ -484,6 +556,21 @@ class Wiki(metaclass=abc.ABCMeta):
         pages = self._list_pages_parsed(**kwargs)
         return [p for p in pages if p.url in urls]
 
+###############################################################################
+# Funciones de Ayuda
+###############################################################################
+
+
+@functools.lru_cache(maxsize=256)
+def parse_html(html):
+    """
+    Analiza el html con lxml.
+
+    Los árboles se guardan en un caché acotado en vez de en cada página, para
+    que recorrer miles de páginas no mantenga todos sus árboles en memoria.
+    """
+    return lxml.html.fromstring(html)
+
 ###############################################################################
 # Contenedores de Tuplas Nombradas
 ###############################################################################
@@ -9,7 +9,7 @@ import logging
 import peewee
 import queue
 
-from itertools import islice
+from itertools import chain, islice
 
 ###############################################################################
 # Constantes Globales Y Variables
@@ -17,7 +17,26 @@ from itertools import islice
 
 log = logging.getLogger('pyscp.orm')
 pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-queue = queue.Queue()
+# acotada para que los hilos de descarga esperen al escritor en vez de
+# acumular en memoria todo lo pendiente de escribir
+queue = queue.Queue(maxsize=1000)
+
+# Los snapshots se escriben de una sola vez y pueden volver a crearse, así que
+# se cambia durabilidad por velocidad de escritura.
+PRAGMAS = [
+    ('journal_mode', 'wal'),
+    ('synchronous', 'off'),
+    ('temp_store', 'memory'),
+    ('cache_size', -200000)]
+
+# Para leer un snapshot ya hecho: el archivo se mapea en memoria y la conexión
+# no acepta escrituras. El modo del journal no se toca, ya que cambiarlo
+# escribe en la base de datos.
+READ_PRAGMAS = [
+    ('mmap_size', 1024 ** 3),
+    ('temp_store', 'memory'),
+    ('cache_size', -200000),
+    ('query_only', 1)]
 
 
 def queue_execution(fn, args=(), kw={}):
@@ -49,19 +68,42 @@ class BaseModel(peewee.Model):
     @classmethod
     def insert_many(cls, data):
         data_iter = iter(data)
-        chunk = list(islice(data_iter, 500))
+        first = next(data_iter, None)
+        if first is None:
+            return
+        fields = list(first)
+        cls.insert_rows(fields, (
+            tuple(row[f] for f in fields) for row in chain([first], data_iter)))
+
+    @classmethod
+    def insert_rows(cls, fields, rows):
+        """Inserta filas dadas como tuplas en el orden de fields."""
+        rows = iter(rows)
+        chunk = list(islice(rows, 500))
         while chunk:
-            queue_execution(
-                fn=lambda x: super(BaseModel, cls).insert_many(x).execute(),
-                args=(chunk, ))
-            chunk = list(islice(data_iter, 500))
+            queue_execution(fn=cls._execute_many, args=(fields, chunk))
+            chunk = list(islice(rows, 500))
+
+    @classmethod
+    def _execute_many(cls, fields, rows):
+        """Inserta las filas con un solo executemany sobre el cursor."""
+        sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+            cls._meta.db_table,
+            ', '.join('"{}"'.format(cls._meta.fields[f].db_column)
+                      for f in fields),
+            ', '.join('?' * len(fields)))
+        db.get_cursor().executemany(sql, rows)
+
+    @classmethod
+    def get_id(cls, value):
+        if value not in cls._id_cache:
+            cls._id_cache.append(value)
+        return cls._id_cache.index(value) + 1
 
     @classmethod
     def convert_to_id(cls, data, key='user'):
         for row in data:
-            if row[key] not in cls._id_cache:
-                cls._id_cache.append(row[key])
-            row[key] = cls._id_cache.index(row[key]) + 1
+            row[key] = cls.get_id(row[key])
             yield row
 
     @classmethod
@@ -101,6 +143,10 @@ class Revision(BaseModel):
     time = peewee.DateTimeField()
     comment = peewee.CharField(null=True)
 
+    class Meta:
+        # búsquedas de la revisión cero (autor y fecha de creación)
+        indexes = ((('page', 'number'), False),)
+
 
 class Vote(BaseModel):
     page = peewee.ForeignKeyField(Page, related_name='votes', index=True)
@@ -157,7 +203,7 @@ def async_write(buffer=[]):
     item = queue.get()
     buffer.append(item)
     if len(buffer) > 500 or queue.empty():
-        log.debug('Processing {} queue items.'.format(len(buffer)))
+        log.debug('Processing %d queue items.', len(buffer))
         with db.transaction():
             write_buffer(buffer)
         buffer.clear()
@@ -169,8 +215,7 @@ def write_buffer(buffer):
             item['fn'](*item.get('args', ()), **item.get('kw', {}))
         except:
             log.exception(
-                'Exception while processing queue item: {}'
-                .format(item))
+                'Exception while processing queue item: %s', item)
         queue.task_done()
 
 
@@ -179,10 +224,19 @@ def create_tables(*tables):
         eval(table).create_table()
 
 
-def connect(dbpath):
-    log.info('Connecting to the database at {}'.format(dbpath))
-    db.initialize(peewee.SqliteDatabase(dbpath))
+def connect(dbpath, read_only=False):
+    log.info('Connecting to the database at %s', dbpath)
+    # una conexión por hilo: las lecturas de cada hilo no comparten conexión
+    db.initialize(peewee.SqliteDatabase(
+        dbpath, pragmas=READ_PRAGMAS if read_only else PRAGMAS,
+        threadlocals=True))
     db.connect()
+    if not read_only and Revision._meta.db_table in db.get_tables():
+        # los snapshots anteriores al índice de Revision no lo tienen; el
+        # nombre es el que genera peewee, así create_tables no lo duplica
+        db.execute_sql(
+            'CREATE INDEX IF NOT EXISTS revision_page_id_number '
+            'ON revision (page_id, number)')
 
 
 ###############################################################################
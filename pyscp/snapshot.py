@@ -11,10 +11,9 @@ y comunicación con el sqlite Snapshots.
 # Modulos Importados
 ###############################################################################
 
-import bs4
+import collections
 import concurrent.futures
 import functools
-import itertools
 import logging
 import operator
 import pathlib
@@ -29,6 +28,46 @@ from pyscp import core, orm, utils
 
 log = logging.getLogger(__name__)
 
+# Consultas de las propiedades de Page. Van en SQL directo para no construir
+# un modelo de peewee por cada fila leída.
+HISTORY_SQL = (
+    'SELECT r.id, r.number, u.name, r.time, r.comment FROM "revision" r '
+    'JOIN "user" u ON r.user_id = u.id '
+    'WHERE r.page_id = ? ORDER BY r.number')
+VOTES_SQL = (
+    'SELECT u.name, v.value FROM "vote" v '
+    'JOIN "user" u ON v.user_id = u.id WHERE v.page_id = ?')
+TAGS_SQL = (
+    'SELECT t.name FROM "pagetag" pt '
+    'JOIN "tag" t ON pt.tag_id = t.id WHERE pt.page_id = ?')
+
+# Las mismas consultas para varias páginas a la vez, usadas por Wiki.prefetch.
+# La primera columna es siempre la url de la página; {} se reemplaza por los
+# parámetros de las urls pedidas.
+BULK_SQL = {
+    '_pdata': 'SELECT url, id, thread_id, html FROM "page" WHERE url IN ({})',
+    'history': (
+        'SELECT p.url, r.id, r.number, u.name, r.time, r.comment '
+        'FROM "revision" r JOIN "user" u ON r.user_id = u.id '
+        'JOIN "page" p ON r.page_id = p.id WHERE p.url IN ({}) '
+        'ORDER BY r.number'),
+    'votes': (
+        'SELECT p.url, u.name, v.value FROM "vote" v '
+        'JOIN "user" u ON v.user_id = u.id '
+        'JOIN "page" p ON v.page_id = p.id WHERE p.url IN ({})'),
+    'tags': (
+        'SELECT p.url, t.name FROM "pagetag" pt '
+        'JOIN "tag" t ON pt.tag_id = t.id '
+        'JOIN "page" p ON pt.page_id = p.id WHERE p.url IN ({})')}
+# Urls por consulta; SQLite limita el número de parámetros a 999.
+BULK_SIZE = 500
+
+# Operadores aceptados por los filtros de rating y fecha de list_pages.
+_OPERATOR_RE = re.compile(r'(\d+)')
+OPERATORS = {
+    '>': operator.gt, '<': operator.lt, '>=': operator.ge, '<=': operator.le,
+    '=': operator.eq, '': operator.eq}
+
 ###############################################################################
 
 
@@ -39,10 +78,9 @@ class Page(core.Page):
     # Métodos Internos
     ###########################################################################
 
-    def _query(self, ptable, stable='User'):
-        """Genera consultas SQL usando los datos recabados."""
-        pt, st = [getattr(orm, i) for i in (ptable, stable)]
-        return pt.select(pt, st.name).join(st).where(pt.page == self._id)
+    def _query(self, sql):
+        """Ejecuta una consulta SQL sobre las filas de esta página."""
+        return orm.db.execute_sql(sql, (self._id,)).fetchall()
 
     @utils.cached_property
     def _pdata(self):
@@ -62,22 +100,17 @@ class Page(core.Page):
     @utils.cached_property
     def history(self):
         """Retorna las revisiones de la página."""
-        revs = self._query('Revision')
-        revs = sorted(revs, key=lambda x: x.number)
-        return [core.Revision(
-                r.id, r.number, r.user.name, str(r.time), r.comment)
-                for r in revs]
+        return [core.Revision(*r) for r in self._query(HISTORY_SQL)]
 
     @utils.cached_property
     def votes(self):
         """Retorna todos los votos hechos en la página."""
-        return [core.Vote(v.user.name, v.value)
-                for v in self._query('Vote')]
+        return [core.Vote(*v) for v in self._query(VOTES_SQL)]
 
     @utils.cached_property
     def tags(self):
         """Retorna el juego de etiquétas con las que la página fue etiquetada."""
-        return {pt.tag.name for pt in self._query('PageTag', 'Tag')}
+        return {t for t, in self._query(TAGS_SQL)}
 
 
 class Thread(core.Thread):
@@ -112,7 +145,7 @@ class Wiki(core.Wiki):
         if not pathlib.Path(dbpath).exists():
             raise FileNotFoundError(dbpath)
         self.dbpath = dbpath
-        orm.connect(dbpath)
+        orm.connect(dbpath, read_only=True)
 
     def __repr__(self):
         """Impresión bonita en la instancia actual."""
@@ -127,61 +160,110 @@ class Wiki(core.Wiki):
     ###########################################################################
 
     @staticmethod
-    def _filter_author(author):
-        return (orm.Page.select(orm.Page.url)
-                .join(orm.Revision).join(orm.User)
-                .where(orm.Revision.number == 0)
-                .where(orm.User.name == author))
+    def _filter_author(query, author):
+        return (query.switch(orm.Revision).join(orm.User)
+                .where(orm.User.name == author)
+                .switch(orm.Page))
 
     @staticmethod
-    def _filter_tag(tag):
-        return (orm.Page.select(orm.Page.url)
-                .join(orm.PageTag).join(orm.Tag)
-                .where(orm.Tag.name == tag))
+    def _filter_tag(query, tag):
+        return (query.join(orm.PageTag).join(orm.Tag)
+                .where(orm.Tag.name == tag)
+                .switch(orm.Page))
 
     @staticmethod
+    @functools.lru_cache(maxsize=64)
     def _get_operator(string):
-        symbol, *values = re.split(r'(\d+)', string)
-        opdict = {
-            '>': 'gt', '<': 'lt', '>=': 'ge', '<=': 'le', '=': 'eq', '': 'eq'}
-        if symbol not in opdict:
+        symbol, *values = _OPERATOR_RE.split(string)
+        if symbol not in OPERATORS:
             raise ValueError
-        return getattr(operator, opdict[symbol]), values
+        return OPERATORS[symbol], tuple(values)
 
-    def _filter_rating(self, rating):
+    def _filter_rating(self, query, rating):
         compare, values = self._get_operator(rating)
         rating = int(values[0])
-        return (orm.Page.select(orm.Page.url)
-                .join(orm.Vote).group_by(orm.Page.url)
+        return (query.join(orm.Vote).switch(orm.Page)
+                .group_by(orm.Page.url)
                 .having(compare(orm.peewee.fn.sum(orm.Vote.value), rating)))
 
-    def _filter_created(self, created):
+    def _filter_created(self, query, created):
         compare, values = self._get_operator(created)
         date = '-'.join(values[::2])
-        return (orm.Page.select(orm.Page.url)
-                .join(orm.Revision).where(orm.Revision.number == 0)
-                .group_by(orm.Page.url)
-                .having(compare(
-                    orm.peewee.fn.substr(orm.Revision.time, 1, len(date)),
-                    date)))
+        return query.where(compare(
+            orm.peewee.fn.substr(orm.Revision.time, 1, len(date)), date))
 
     def _list_pages_parsed(self, **kwargs):
+        """
+        Construye una sola consulta con todos los filtros dados.
+
+        Los filtros de autor y de fecha comparten la unión con la revisión
+        cero de la página; el resto agrega sus propias uniones.
+        """
         query = orm.Page.select(orm.Page.url)
+        if 'author' in kwargs or 'created' in kwargs:
+            query = (query.join(orm.Revision)
+                     .where(orm.Revision.number == 0)
+                     .switch(orm.Page))
         keys = ('author', 'tag', 'rating', 'created')
         keys = [k for k in keys if k in kwargs]
         for k in keys:
-            query = query & getattr(self, '_filter_' + k)(kwargs[k])
+            query = getattr(self, '_filter_' + k)(query, kwargs[k])
         if 'limit' in kwargs:
             query = query.limit(kwargs['limit'])
         return map(self, [p.url for p in query])
 
+    ###########################################################################
+    # Métodos Públicos
+    ###########################################################################
+
+    def prefetch(self, pages, *attrs, **kwargs):
+        """
+        Precarga los atributos dados de las páginas.
+
+        Cada uno de _pdata, history, votes y tags se carga con una consulta
+        por cada BULK_SIZE urls pedidas, en vez de una consulta por página.
+        Las páginas con la misma url reciben el mismo valor.
+        Otros atributos se precargan como en core.Wiki.prefetch.
+        """
+        pages = list(pages)
+        by_url = collections.defaultdict(list)
+        for page in pages:
+            by_url[page.url].append(page)
+        urls = list(by_url)
+        for attr in attrs:
+            if attr not in BULK_SQL:
+                super().prefetch(pages, attr, **kwargs)
+                continue
+            rows = collections.defaultdict(list)
+            for i in range(0, len(urls), BULK_SIZE):
+                batch = urls[i:i + BULK_SIZE]
+                sql = BULK_SQL[attr].format(', '.join('?' * len(batch)))
+                for url, *row in orm.db.execute_sql(sql, batch):
+                    rows[url].append(row)
+            for url, group in by_url.items():
+                if attr == '_pdata':
+                    if url not in rows:
+                        continue
+                    value = tuple(rows[url][0])
+                elif attr == 'history':
+                    value = [core.Revision(*r) for r in rows[url]]
+                elif attr == 'votes':
+                    value = [core.Vote(*r) for r in rows[url]]
+                elif attr == 'tags':
+                    value = {t for t, in rows[url]}
+                for page in group:
+                    vars(page)[attr] = value
+
     ###########################################################################
     # Métodos Específicos Para La Wiki SCP
     ###########################################################################
 
-    @functools.lru_cache(maxsize=1)
     def list_images(self):
         """Metadatos de imagen."""
+        return self._images
+
+    @utils.cached_property
+    def _images(self):
         query = (
             orm.Image.select(orm.Image, orm.ImageStatus.name)
             .join(orm.ImageStatus))
@@ -227,6 +309,10 @@ class SnapshotCreator:
         orm.queue.join()
         self._save_cache()
         orm.queue.join()
+        # vuelca el WAL a la base de datos para que el snapshot quede en un
+        # solo archivo, sin los -wal y -shm al lado
+        orm.db.execute_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+        orm.db.close()
         log.info('Snapshot succesfully taken.')
 
     def _save_all_pages(self):
@@ -238,27 +324,40 @@ class SnapshotCreator:
             self.wiki.list_pages(body='total', limit=1))._body['total']
         bar = utils.ProgressBar('Guardando Página'.ljust(20), int(count))
         bar.start()
-        for _ in self.pool.map(self._save_page, self.wiki.list_pages()):
+        # se avanza según terminan las páginas, no en el orden del listado,
+        # y no se encolan más de 40 páginas a la vez
+        pending = set()
+        for page in self.wiki.list_pages():
+            if len(pending) >= 40:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                    bar.value += 1
+            pending.add(self.pool.submit(self._save_page, page))
+        for future in concurrent.futures.as_completed(pending):
+            future.result()
             bar.value += 1
         bar.stop()
 
     @utils.ignore(requests.HTTPError)
     def _save_page(self, page):
         """Descarga contenidos, revisiones, votos y discusiones de la página."""
+        # todas las descargas se hacen antes de encolar cualquier escritura,
+        # así un error de red no deja la página guardada a medias
+        user_id = orm.User.get_id
+        revisions = [
+            (page._id, r.id, r.number, user_id(r.user), r.time, r.comment)
+            for r in page.history]
+        votes = [(page._id, user_id(v.user), v.value) for v in page.votes]
+        tags = [(page._id, orm.Tag.get_id(t)) for t in page.tags]
+
         orm.Page.create(
             id=page._id, url=page.url, thread=page._thread._id, html=page.html)
-
-        revisions = orm.User.convert_to_id(i._asdict() for i in page.history)
-        votes = orm.User.convert_to_id(i._asdict() for i in page.votes)
-        tags = [{'tag': t} for t in page.tags]
-        tags = orm.Tag.convert_to_id(tags, key='tag')
-
-        def _insert(table, data):
-            table.insert_many(dict(i, page=page._id) for i in data)
-
-        _insert(orm.Revision, revisions)
-        _insert(orm.Vote, votes)
-        _insert(orm.PageTag, tags)
+        orm.Revision.insert_rows(
+            ('page', 'id', 'number', 'user', 'time', 'comment'), revisions)
+        orm.Vote.insert_rows(('page', 'user', 'value'), votes)
+        orm.PageTag.insert_rows(('page', 'tag'), tags)
 
         self._save_thread(page._thread)
 
@@ -276,9 +375,16 @@ class SnapshotCreator:
         bar = utils.ProgressBar('GUARDANDO HILO DEL FORO', total_size)
         bar.start()
         for cat in cats:
-            threads = set(self.wiki.list_threads(cat.id))
-            c_id = itertools.repeat(cat.id)
-            for _ in self.pool.map(self._save_thread, threads, c_id):
+            # los hilos se encolan según llegan, sin esperar al listado entero
+            seen, futures = set(), []
+            for thread in self.wiki.list_threads(cat.id):
+                if thread._id in seen:
+                    continue
+                seen.add(thread._id)
+                futures.append(
+                    self.pool.submit(self._save_thread, thread, cat.id))
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
                 bar.value += 1
         bar.stop()
 
@@ -310,7 +416,7 @@ class SnapshotCreator:
     def _save_image(self, image):
         self.ibar.value += 1
         if not image.source:
-            log.info('Dirección de la imágen no especificado: ' + image.url)
+            log.info('Dirección de la imágen no especificado: %s', image.url)
             return
         return self.wiki.req.get(image.url, allow_redirects=True).content
 
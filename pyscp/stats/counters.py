@@ -11,8 +11,11 @@ Take a list of pages and a scalar, and return a collections.Counter instance.
 ###############################################################################
 
 import collections
+import operator
 import re
 
+_BLOCK_RE = re.compile(r'[0-9]{3,4}$')
+
 ###############################################################################
 
 
@@ -28,7 +31,7 @@ def make_counter(pages, func, key):
 
 def author(pages, func):
     """Agrupa por página de autor."""
-    return make_counter(pages, func, lambda p: p.author)
+    return make_counter(pages, func, operator.attrgetter('author'))
 
 
 def month(pages, func):
@@ -38,21 +41,20 @@ def month(pages, func):
 
 def page(pages, func):
     """Cada página en su propio grupo."""
-    return make_counter(pages, func, lambda p: p.url)
+    return make_counter(pages, func, operator.attrgetter('url'))
 
 
 def block(pages, func):
     """Group skips based on which 100-block they're in."""
     def key(page):
-        if 'scp' not in page.tags:
-            return
-        match = re.search(r'[0-9]{3,4}$', page.url)
+        match = _BLOCK_RE.search(page.url)
         if not match:
             return
         match = int(match.group())
         if match == 1:
             return
         return str((match // 100) * 100).zfill(3)
+    pages = [p for p in pages if 'scp' in p.tags]
     return make_counter(pages, func, key)
 
 
@@ -60,8 +62,16 @@ def chain(pages, func, *counters):
     """Aplicar contadores uno detras de otro."""
     if len(counters) == 1:
         return counters[0](pages, func)
-    results = collections.Counter()
-    for key, val in counters[0](pages, lambda x: x).items():
-        for ikey, ival in chain(val, func, *counters[1:]).items():
-            results['%s, %s' % (key, ikey)] = ival
-    return results
+    return collections.Counter({
+        ', '.join(map(str, keys)): val
+        for keys, val in _chain_keys(pages, func, counters)})
+
+
+def _chain_keys(pages, func, counters, prefix=()):
+    """Genera (claves, valor) para cada combinación de grupos de chain."""
+    if len(counters) == 1:
+        for key, val in counters[0](pages, func).items():
+            yield prefix + (key, ), val
+        return
+    for key, group in counters[0](pages, lambda x: x).items():
+        yield from _chain_keys(group, func, counters[1:], prefix + (key, ))
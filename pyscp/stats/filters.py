@@ -32,7 +32,8 @@ def user(pages, user):
 def min_authored(pages, min_val=3):
     """Pages by authors who have at least min_val pages."""
     authors = cn.author(pages, sc.count)
-    return [p for p in pages if authors[p.author] >= min_val]
+    eligible = {a for a, c in authors.items() if c >= min_val}
+    return [p for p in pages if p.author in eligible]
 
 
 def filter_rating(pages, min_val=20):
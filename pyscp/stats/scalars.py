@@ -6,9 +6,20 @@ Scalars.
 Take a list of pages and return a single value.
 """
 
+###############################################################################
+# Importaciones
+###############################################################################
+
+import re
+
+###############################################################################
+
+_REDACTION_RE = re.compile('█|CENSURADO|ELIMINADO')
+
+
 def upvotes(pages):
     """Votos positivos."""
-    return sum([v.value for v in p.votes].count(1) for p in pages)
+    return sum(1 for p in pages for v in p.votes if v.value == 1)
 
 
 def rating(pages):
@@ -29,9 +40,8 @@ def divided(pages):
 def redactions(pages):
     """Redacción de puntajes."""
     return sum(
-        p.text.count('█') +
-        20 * sum(map(p.text.count, ('CENSURADO', 'ELIMINADO')))
-        for p in pages)
+        1 if match == '█' else 20
+        for p in pages for match in _REDACTION_RE.findall(p.text))
 
 
 def wordcount(pages):
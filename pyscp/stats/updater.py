@@ -35,16 +35,16 @@ class Updater:
 
     def __init__(self, source, target):
         self.pages = list(source.list_pages())
+        source.prefetch(self.pages, '_pdata', 'history', 'votes', 'tags')
         self.target = target
-        self.exist = [p.url for p in target.list_pages()]
+        self.exist = {p.url for p in target.list_pages()}
 
     @staticmethod
     def source_counter(counter):
         """Construye un código de marcado wikidot para el ranking de las páginas."""
         source = ['||~ Posición||~ Usuario||~ Puntaje||']
         # ordenado por puntaje, después alfabeticamente por usuarios
-        items = sorted(counter.items(), key=lambda x: x[0].lower())
-        items = sorted(items, key=lambda x: x[1], reverse=True)
+        items = sorted(counter.items(), key=lambda x: (-x[1], x[0].lower()))
         template = '||{}||[[[user:{}]]]||{}||'
         for idx, (user, score) in enumerate(items):
             source.append(template.format(idx + 1, user, score))
@@ -73,6 +73,7 @@ class Updater:
                 title = name.split(':')
                 response = p.create(source, title)
             if response['status'] == 'ok':
+                self.exist.add(p.url)
                 return
         log.error('Falla al postear: %s', name)
 
@@ -93,17 +93,23 @@ def decochain(call, *decs):
 
 
 class cached_property:
+    """
+    Propiedad que se calcula una sola vez por instancia.
+
+    El valor se guarda en el __dict__ de la instancia con el mismo nombre,
+    así los siguientes accesos no pasan por el descriptor. Para descartarlo
+    basta con borrar el atributo.
+    """
 
     def __init__(self, func):
         self.func = func
         functools.update_wrapper(self, func)
 
     def __get__(self, obj, cls):
-        if not hasattr(obj, '_cache'):
-            obj._cache = {}
-        if self.func.__name__ not in obj._cache:
-            obj._cache[self.func.__name__] = self.func(obj)
-        return obj._cache[self.func.__name__]
+        if obj is None:
+            return self
+        value = obj.__dict__[self.func.__name__] = self.func(obj)
+        return value
 
 ###############################################################################
 
@@ -13,12 +13,18 @@ y la comunación con los sitio hosteados en Wikidot.
 
 import arrow
 import bs4
-import functools
+import collections
+import concurrent.futures
+import copy
 import itertools
 import logging
+import lxml.etree
+import lxml.html
 import pyscp
+import random
 import re
 import requests
+import time
 
 ###############################################################################
 # Constantes Globales Y Variables
@@ -26,6 +32,22 @@ import requests
 
 log = logging.getLogger(__name__)
 
+# Hijos directos de un elemento que son contenedores de post del foro.
+_POST_CONTAINERS = lxml.etree.XPath(
+	'*[contains(concat(" ", @class, " "), " post-container ")]')
+# Enlaces dentro de un elemento .title, como el selector '.title a'.
+_TITLE_LINKS = lxml.etree.XPath(
+	'.//*[contains(concat(" ", @class, " "), " title ")]//a')
+# Etiquetas de la página, como el selector '.page-tags a'.
+_TAG_LINKS = lxml.etree.XPath(
+	'//*[contains(concat(" ", @class, " "), " page-tags ")]//a')
+# Filas con celdas de las tablas de revisión de imágenes.
+_IMAGE_ROWS = lxml.etree.XPath('//tr[td]')
+
+_PAGE_ID_RE = re.compile(rb'pageId = ([0-9]+);')
+_HREF_ID_RE = re.compile(r'/[^/]+/[^-/]+-([0-9]+)')
+_UNIXTIME_RE = re.compile(r'time_([0-9]+)')
+
 
 ###############################################################################
 # Clases de Utilidad
@@ -34,19 +56,29 @@ log = logging.getLogger(__name__)
 class InsistentRequest(requests.Session):
 	"""Realiza un auto-reintento de petición que maneja la perdida de conexión."""
 
-	def __init__(self, max_attempts=10):
+	def __init__(self, max_attempts=10, pool_connections=16, pool_maxsize=50):
 		super().__init__()
 		self.max_attempts = max_attempts
+		# mantiene las conexiones abiertas entre peticiones; el pool por
+		# defecto (10) es menor que el número de hilos usados en los snapshots
+		adapter = requests.adapters.HTTPAdapter(
+			pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+		self.mount('http://', adapter)
+		self.mount('https://', adapter)
 
 	def __repr__(self):
 		return '{}(max_attempts={})'.format(
 			self.__class__.__name__, self.max_attempts)
 
 	def request(self, method, url, **kwargs):
-		log.debug('%s: %s %s', method, url, repr(kwargs) if kwargs else '')
+		log.debug('%s: %s %r', method, url, kwargs)
 		kwargs.setdefault('timeout', 60)
 		kwargs.setdefault('allow_redirects', False)
-		for _ in range(self.max_attempts):
+		for attempt in range(self.max_attempts):
+			if attempt:
+				time.sleep(delay)
+			# espera exponencial con jitter, a lo sumo de 30 segundos
+			delay = min(30, 2 ** attempt * (1 + random.uniform(0, 0.5)))
 			try:
 				resp = super().request(method=method, url=url, **kwargs)
 			except (
@@ -59,8 +91,17 @@ class InsistentRequest(requests.Session):
 			elif 300 <= resp.status_code < 400:
 				raise requests.HTTPError(
 					'Redirect attempted with url: {}'.format(url))
-			elif 400 <= resp.status_code < 600:
-				continue
+			elif resp.status_code in (429, 503):
+				# el servidor pide esperar; si dice cuánto, se respeta sin límite
+				retry_after = resp.headers.get('Retry-After', '')
+				if retry_after.isdigit():
+					delay = int(retry_after)
+			elif 400 <= resp.status_code < 500:
+				# los demás errores del cliente no se arreglan reintentando
+				resp.raise_for_status()
+			# devuelve la conexión al pool antes de reintentar; con stream=True
+			# el cuerpo no se ha leído y la conexión seguiría ocupada
+			resp.close()
 		raise requests.ConnectionError(
 			'Se ha excedido el máximo de reintentos con la url: {}'.format(url))
 
@@ -103,18 +144,39 @@ class Page(pyscp.core.Page):
 			force=True)
 
 	def _flush(self, *names):
-		if not hasattr(self, '_cache'):
-			return
-		self._cache = {k: v for k, v in self._cache.items() if k not in names}
+		for name in names:
+			self.__dict__.pop(name, None)
 
 	@pyscp.utils.cached_property
 	def _pdata(self):
-		data = self._wiki.req.get(self.url).text
-		soup = bs4.BeautifulSoup(data, 'lxml')
-		return (int(re.search('pageId = ([0-9]+);', data).group(1)),
-				parse_element_id(soup.find(id='discuss-button')),
-				str(soup.find(id='main-content')),
-				{e.text for e in soup.select('.page-tags a')})
+		# el html se analiza a medida que llega, en vez de esperar a tener
+		# la respuesta entera en memoria
+		resp = self._wiki.req.get(self.url, stream=True)
+		parser = lxml.html.HTMLParser(encoding=resp.encoding)
+		match, tail = None, b''
+		for chunk in resp.iter_content(65536):
+			parser.feed(chunk)
+			if match is None:
+				tail += chunk
+				match = _PAGE_ID_RE.search(tail)
+				tail = tail[-32:]
+		tree = parser.close()
+		content = tree.get_element_by_id('main-content', None)
+		if content is not None:
+			# una copia suelta, para no retener el resto del documento
+			content = copy.deepcopy(content)
+		return (int(match.group(1)),
+				parse_element_id(tree.get_element_by_id('discuss-button', None)),
+				content,
+				{e.text_content() for e in _TAG_LINKS(tree)})
+
+	@property
+	def _lxml(self):
+		# se usa directamente el árbol de _pdata, sin serializarlo y volver
+		# a analizarlo como hace core.Page
+		if self._pdata[2] is None:
+			return lxml.html.Element('div')
+		return self._pdata[2]
 
 	@property
 	def _raw_title(self):
@@ -132,9 +194,13 @@ class Page(pyscp.core.Page):
     # Propiedades
     ###########################################################################
 
-	@property
+	@pyscp.utils.cached_property
 	def html(self):
-		return self._pdata[2]
+		# _pdata guarda el elemento; se serializa solo si se pide el html
+		if self._pdata[2] is None:
+			return None
+		return lxml.html.tostring(
+			self._pdata[2], encoding='unicode', with_tail=False)
 
 	@pyscp.utils.cached_property
 	@pyscp.utils.listify()
@@ -142,22 +208,22 @@ class Page(pyscp.core.Page):
 		"""Retorna el historial de revisiones de la página."""
 		data = self._module(
 			'history/PageRevisionListModule', page=1, perpage=99999)['body']
-		soup = bs4.BeautifulSoup(data, 'lxml')
-		for row in reversed(soup('tr')[1:]):
-			rev_id = int(row['id'].split('-')[-1])
-			cells = row('td')
-			number = int(cells[0].text.strip('.'))
-			user = cells[4].text
+		rows = list(parse_fragment(data).iter('tr'))
+		for row in reversed(rows[1:]):
+			rev_id = int(row.get('id').split('-')[-1])
+			cells = row.xpath('.//td')
+			number = int(cells[0].text_content().strip('.'))
+			user = cells[4].text_content()
 			time = parse_element_time(cells[5])
-			comment = cells[6].text if cells[6].text else None
+			comment = cells[6].text_content() or None
 			yield pyscp.core.Revision(rev_id, number, user, time, comment)
 
 	@pyscp.utils.cached_property
 	def votes(self):
 		"""Retorna todos los votos hechos en la página."""
 		data = self._module('pagerate/WhoRatedPageModule')['body']
-		soup = bs4.BeautifulSoup(data, 'lxml')
-		spans = [i.text.strip() for i in soup('span')]
+		spans = parse_fragment(data).iter('span')
+		spans = [i.text_content().strip() for i in spans]
 		pairs = zip(spans[::2], spans[1::2])
 		return [pyscp.core.Vote(u, 1 if v == '+' else -1) for u, v in pairs]
 
@@ -167,11 +233,11 @@ class Page(pyscp.core.Page):
 			return set(self._body['tags'].split())
 		return self._pdata[3]
 
-	@property
+	@pyscp.utils.cached_property
 	def source(self):
 		data = self._module('viewsource/ViewSourceModule')['body']
-		soup = bs4.BeautifulSoup(data, 'lxml')
-		return soup.text[11:].strip().replace(chr(160), ' ')
+		text = parse_fragment(data).text_content()
+		return text[11:].strip().replace(chr(160), ' ')
 
 	@property
 	def created(self):
@@ -211,11 +277,9 @@ class Page(pyscp.core.Page):
 			revision_id=lock.get('page_revision_id', None))
 
 	def create(self, source, title, comment=None):
-		if not hasattr(self, '_cache'):
-			self._cache = {}
-		self._cache['_pdata'] = (None, None, None)
+		self.__dict__['_pdata'] = (None, None, None)
 		response = self.edit(source, title, comment)
-		del self._cache['_pdata']
+		del self._pdata
 		return response
 
 	def revert(self, rev_n):
@@ -226,7 +290,7 @@ class Page(pyscp.core.Page):
 	def set_tags(self, tags):
 		"""Reemplaza las etiquetas en la página."""
 		res = self._action('saveTags', tags=' '.join(tags))
-		self._flush('history', '_pdata')
+		self._flush('history', '_pdata', 'html')
 		return res
 
 	def upload(self, name, data):
@@ -274,18 +338,17 @@ class Thread(pyscp.core.Thread):
 			return
 		pages = self._wiki._pager(
 			'forum/ForumViewThreadPostsModule', _key='pageNo', t=self._id)
-		pages = (bs4.BeautifulSoup(p['body'], 'lxml').body for p in pages)
-		pages = (p for p in pages if p)
-		posts = (p(class_='post-container', recursive=False) for p in pages)
+		posts = (_POST_CONTAINERS(parse_fragment(p['body'])) for p in pages)
 		posts = itertools.chain.from_iterable(posts)
 		for post, parent in crawl_posts(posts):
-			post_id = int(post['id'].split('-')[1])
-			title = post.find(class_='title').text.strip()
+			post_id = int(post.get('id').split('-')[1])
+			title = post.find_class('title')[0].text_content().strip()
 			title = title if title else None
-			content = post.find(class_='content')
-			content.attrs.clear()
-			content = str(content)
-			user = post.find(class_='printuser').text
+			content = post.find_class('content')[0]
+			content.attrib.clear()
+			content = lxml.html.tostring(
+				content, encoding='unicode', with_tail=False)
+			user = post.find_class('printuser')[0].text_content()
 			time = parse_element_time(post)
 			yield pyscp.core.Post(post_id, title, content, user, time, 
 			parent)
@@ -321,6 +384,10 @@ class Wiki(pyscp.core.Wiki):
 	def __init__(self, site):
 		super().__init__(site)
 		self.req = InsistentRequest()
+		# hilos compartidos por todas las descargas en paralelo de la wiki
+		# (_pager, list_images), así el total de peticiones extra en vuelo no
+		# pasa de ocho aunque se llame desde varios hilos a la vez
+		self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
 
 	def __repr__(self):
 		return '{}.{}({})'.format(
@@ -328,6 +395,17 @@ class Wiki(pyscp.core.Wiki):
 			self.__class__.__name__,
 			repr(self.site))
 
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		"""Cierra las conexiones abiertas de la sesión."""
+		self._pool.shutdown()
+		self.req.close()
+
     ###########################################################################
     # Métodos Internos
     ###########################################################################
@@ -357,13 +435,26 @@ class Wiki(pyscp.core.Wiki):
 		"""Itera sobre los resultados del módulo multi-page."""
 		first_page = self._module(_name, **kwargs)
 		yield first_page
-		counter = bs4.BeautifulSoup(
-			first_page['body'], 'lxml').find(class_='pager-no')
+		counter = parse_fragment(first_page['body']).find_class('pager-no')
 		if not counter:
 			return
-		for idx in range(2, int(counter.text.split(' ')[-1]) + 1):
-			kwargs.update({_key: idx if _update is None else _update(idx)})
-			yield self._module(_name, **kwargs)
+
+		def fetch(idx):
+			value = idx if _update is None else _update(idx)
+			return self._module(_name, **dict(kwargs, **{_key: value}))
+
+		# las páginas restantes se piden en paralelo y se entregan en orden,
+		# con a lo sumo ocho peticiones pendientes a la vez
+		total = int(counter[0].text_content().split(' ')[-1])
+		indexes = iter(range(2, total + 1))
+		window = collections.deque(
+			self._pool.submit(fetch, idx)
+			for idx in itertools.islice(indexes, 8))
+		while window:
+			page = window.popleft().result()
+			for idx in itertools.islice(indexes, 1):
+				window.append(self._pool.submit(fetch, idx))
+			yield page
 
 	def _list_pages_raw(self, **kwargs):
 		"""
@@ -377,7 +468,7 @@ class Wiki(pyscp.core.Wiki):
 		yield from self._pager(
 			'list/ListPagesModule',
 			_key='offset',
-			_update=lambda x: 250 * (x - 1),
+			_update=list_pages_offset,
 			perPage=250,
 			**kwargs)
 
@@ -393,13 +484,16 @@ class Wiki(pyscp.core.Wiki):
 			map('||{0}||%%{0}%% ||'.format, keys))
 		kwargs['created_by'] = kwargs.pop('author', None)
 		lists = self._list_pages_raw(**kwargs)
-		soups = (bs4.BeautifulSoup(p['body'], 'lxml') for p in lists)
-		pages = (s.select('div.list-pages-item') for s in soups)
+		trees = (parse_fragment(p['body']) for p in lists)
+		pages = (t.find_class('list-pages-item') for t in trees)
 		pages = itertools.chain.from_iterable(pages)
 		for page in pages:
+			rows = (r.xpath('.//td') for r in page.iter('tr'))
 			data = {
-				r('td')[0].text: r('td')[1].text.strip() for r in page('tr')}
-			page = self(data['fullname'])
+				r[0].text_content(): r[1].text_content().strip() for r in rows}
+			# fullname ya es el nombre normalizado de la página, así que no
+			# hace falta pasar por Wiki.__call__
+			page = self.Page(self, self.site + '/' + data['fullname'])
 			page._body = data
 			yield page
 
@@ -420,11 +514,11 @@ class Wiki(pyscp.core.Wiki):
 	def list_categories(self):
 		"""Retorna las categorias del foro."""
 		data = self._module('forum/ForumStartModule')['body']
-		soup = bs4.BeautifulSoup(data, 'lxml')
-		for elem in [e.parent for e in soup(class_='name')]:
-			cat_id = parse_element_id(elem.select('.title a')[0])
+		names = parse_fragment(data).find_class('name')
+		for elem in [e.getparent() for e in names]:
+			cat_id = parse_element_id(_TITLE_LINKS(elem)[0])
 			title, description, size = [
-				elem.find(class_=i).text.strip()
+				elem.find_class(i)[0].text_content().strip()
 				for i in ('title', 'description', 'threads')]
 			yield pyscp.core.Category(
 				cat_id, title, description, int(size))
@@ -433,12 +527,11 @@ class Wiki(pyscp.core.Wiki):
 		"""Retorna los hilos en la categoria dada."""
 		pages = self._pager(
 			'forum/ForumViewCategoryModule', _key='p', c=category_id)
-		soups = (bs4.BeautifulSoup(p['body'], 'lxml') for p in pages)
-		elems = (s(class_='name') for s in soups)
-		for elem in itertools.chain(*elems):
-			thread_id = parse_element_id(elem.select('.title a')[0])
+		elems = (parse_fragment(p['body']).find_class('name') for p in pages)
+		for elem in itertools.chain.from_iterable(elems):
+			thread_id = parse_element_id(_TITLE_LINKS(elem)[0])
 			title, description = [
-				elem.find(class_=i).text.strip()
+				elem.find_class(i)[0].text_content().strip()
 				for i in ('title', 'description')]
 			yield self.Thread(self, thread_id, title, description)
 
@@ -466,39 +559,51 @@ class Wiki(pyscp.core.Wiki):
     # Métodos Específicos Para La Wiki SCP
     ###########################################################################
 
-	@functools.lru_cache(maxsize=1)
-	@pyscp.utils.listify()
 	def list_images(self):
+		return self._images
+
+	@pyscp.utils.cached_property
+	@pyscp.utils.listify()
+	def _images(self):
 		if 'lafundacionscp' not in self.site:
 			return
 		base = 'http://borradores-scp-es.wikidot.com/image-review-{}'
 		urls = [base.format(i) for i in range(1, 36)]
-		pages = [self.req.get(u).text for u in urls]
-		soups = [bs4.BeautifulSoup(p, 'lxml') for p in pages]
-		elems = [s('tr') for s in soups]
-		elems = itertools.chain(*elems)
-		elems = [e('td') for e in elems]
-		elems = [e for e in elems if e]
-		for elem in elems:
-			url = elem[0].find('img')['src']
-			source = elem[2].a['href'] if elem[2]('a') else None
-			status, notes = [elem[i].text for i in (3, 4)]
+		pages = list(self._pool.map(lambda u: self.req.get(u).text, urls))
+		rows = itertools.chain.from_iterable(
+			_IMAGE_ROWS(lxml.html.document_fromstring(p)) for p in pages)
+		for elem in (row.findall('td') for row in rows):
+			url = elem[0].find('.//img').get('src')
+			links = elem[2].findall('.//a')
+			source = links[0].get('href') if links else None
+			status, notes = [elem[i].text_content() for i in (3, 4)]
 			status, notes = [i if i else None for i in (status, notes)]
 			yield pyscp.core.Image(url, source, status, notes, None)
 
 ###############################################################################
 
 
-@pyscp.utils.ignore((IndexError, TypeError))
+def list_pages_offset(idx):
+	"""Offset de ListPages para el número de página dado."""
+	return 250 * (idx - 1)
+
+
+def parse_fragment(html):
+	"""Analiza con lxml el cuerpo html devuelto por un módulo."""
+	return lxml.html.fragment_fromstring(html, create_parent='div')
+
+
+@pyscp.utils.ignore((IndexError, TypeError, AttributeError))
 def parse_element_id(element):
 	"""Extrae el número id del enlace."""
-	return int(element['href'].split('/')[2].split('-')[1])
+	return int(_HREF_ID_RE.match(element.get('href')).group(1))
 
 
 def parse_element_time(element):
 	"""Extrae y formatea la hora por un elemento HTML."""
-	unixtime = element.find(class_='odate')['class'][1].split('_')[1]
-	return arrow.get(unixtime).format('YYYY-MM-DD HH:mm:ss')
+	odate = element.find_class('odate')[0]
+	unixtime = _UNIXTIME_RE.search(odate.get('class')).group(1)
+	return arrow.get(int(unixtime)).format('YYYY-MM-DD HH:mm:ss')
 
 
 def crawl_posts(post_containers, parent=None):
@@ -506,11 +611,13 @@ def crawl_posts(post_containers, parent=None):
 	Repure los post del árbol de comentarios.
 	
 	Por cada contenedor de post en la lista dada, retorna una tupla de
-	(post, padre). Then recurses onto all the post-container children
-	of the current post-container.
+	(post, padre), seguida de los post-container hijos del contenedor actual.
+	El árbol se recorre con una pila en vez de recursión, en el mismo orden.
 	"""
-	for container in post_containers:
-		yield container.find(class_='post'), parent
-		yield from crawl_posts(
-			container(class_='post-container', recursive=False),
-			int(container['id'].split('-')[1]))
+	stack = [(c, parent) for c in reversed(list(post_containers))]
+	while stack:
+		container, parent = stack.pop()
+		yield container.find_class('post')[0], parent
+		post_id = int(container.get('id').split('-')[1])
+		children = _POST_CONTAINERS(container)
+		stack.extend((c, post_id) for c in reversed(children))
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import operator
+import pytest
+
+from pyscp import snapshot
+
+###############################################################################
+# Filters
+###############################################################################
+
+
+@pytest.mark.parametrize('string, compare, values', [
+    ('>100', operator.gt, ('100', '')),
+    ('<=-5', None, None),
+    ('100', operator.eq, ('100', '')),
+    ('>=2015-03', operator.ge, ('2015', '-', '03', '')),
+    ('=2014', operator.eq, ('2014', ''))])
+def test_get_operator(string, compare, values):
+    if compare is None:
+        with pytest.raises(ValueError):
+            snapshot.Wiki._get_operator(string)
+        return
+    assert snapshot.Wiki._get_operator(string) == (compare, values)
+
+
+def test_get_operator_is_cached():
+    first = snapshot.Wiki._get_operator('<50')
+    assert snapshot.Wiki._get_operator('<50') is first
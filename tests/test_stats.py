@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import collections
+import pytest
+
+from pyscp.stats import counters
+
+###############################################################################
+
+FakePage = collections.namedtuple('FakePage', 'url author created tags')
+
+
+@pytest.fixture
+def pages():
+    return [
+        FakePage('http://x/scp-es-001', 'andres2055', '2013-06-30', {'scp'}),
+        FakePage('http://x/scp-es-002', 'andres2055', '2013-07-02', {'scp'}),
+        FakePage('http://x/cuento-a', 'andres2055', '2013-06-11', set()),
+        FakePage('http://x/scp-es-040', 'FlameShirt', '2013-06-30', {'scp'})]
+
+###############################################################################
+# Counters
+###############################################################################
+
+
+def test_chain_single_counter(pages):
+    assert counters.chain(pages, len, counters.author) == counters.author(
+        pages, len)
+
+
+def test_chain(pages):
+    result = counters.chain(pages, len, counters.author, counters.month)
+    assert result == collections.Counter({
+        'andres2055, 2013-06': 2,
+        'andres2055, 2013-07': 1,
+        'FlameShirt, 2013-06': 1})
+
+
+def test_chain_three_levels(pages):
+    result = counters.chain(
+        pages, len, counters.author, counters.month, counters.page)
+    assert result['andres2055, 2013-06, http://x/cuento-a'] == 1
+    assert result['FlameShirt, 2013-06, http://x/scp-es-040'] == 1
+    assert len(result) == 4
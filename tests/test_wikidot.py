@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import pathlib
+import pytest
+
+from pyscp import wikidot
+
+###############################################################################
+
+FIXTURES = pathlib.Path(__file__).parent / 'fixtures'
+
+
+def load(name):
+    with (FIXTURES / name).open(encoding='utf-8') as file:
+        return wikidot.parse_fragment(file.read())
+
+
+@pytest.fixture
+def posts():
+    return wikidot._POST_CONTAINERS(load('thread_posts.html'))
+
+###############################################################################
+# Parsers
+###############################################################################
+
+
+def test_parse_element_id():
+    links = wikidot._TITLE_LINKS(load('forum_category.html'))
+    assert [wikidot.parse_element_id(a) for a in links] == [666715, 123456]
+
+
+def test_parse_element_id_missing():
+    assert wikidot.parse_element_id(None) is None
+    link = wikidot.parse_fragment('<a href="http://example.com">x</a>')
+    assert wikidot.parse_element_id(link.find('a')) is None
+
+
+def test_parse_element_time(posts):
+    assert wikidot.parse_element_time(posts[0]) == '2013-06-30 16:47:22'
+
+
+def test_crawl_posts(posts):
+    crawled = [
+        (int(post.get('id').split('-')[1]), parent)
+        for post, parent in wikidot.crawl_posts(posts)]
+    assert crawled == [
+        (1806664, None),
+        (1806700, 1806664),
+        (1806750, 1806700),
+        (1806800, None)]
+
+
+def test_crawl_posts_fields(posts):
+    post, _ = next(wikidot.crawl_posts(posts[1:]))
+    assert post.find_class('title')[0].text_content().strip() == ''
+    assert post.find_class('printuser')[0].text_content() == 'andres2055'
+    assert wikidot.parse_element_time(post) == '2013-06-30 17:23:20'